@@ -1,70 +1,195 @@
 # streamlit_app.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 from PIL import Image
+import hashlib
+import logging
 import os
+import tempfile
+import threading
 
-def resolve_path(raw_path: str, data_dir="data"):
+logger = logging.getLogger(__name__)
+
+THUMB_DIR = ".cache_thumb"
+# sources whose thumbnail conversion failed; served as-is and not retried
+_failed_thumbnails = set()
+# score breakdown name -> question field it tallies
+SCORE_COLUMNS = {"category": "category", "attribute": "attribute", "l2": "l2-category"}
+CSV_COLUMNS = [
+    "image_path", "description_moderate", "preference", "question",
+    "A", "B", "C", "D", "answer", "category", "attribute", "l2-category",
+]
+
+def _open_fast(path: str):
     """
-    Resolve an image path relative to data_dir using the CSV path.
-    Only valid if the file exists exactly at data_dir/raw_path.
+    Open and decode an image; JPEGs are decoded by libjpeg straight at
+    (roughly) the 1024px display size instead of full resolution.
     """
-    # Normalize path separators
-    rel = raw_path.replace("\\", "/").lstrip("/")
-    candidate = os.path.join(data_dir, rel)
-    return candidate
+    im = Image.open(path)
+    try:
+        if im.format == "JPEG":
+            im.draft("RGB", (1024, 1024))
+        im.load()
+    except Exception:
+        im.close()
+        raise
+    return im
+
+def _thumbnail_path(src: str):
+    """Where the JPEG thumbnail of src lives; the key changes with its mtime."""
+    key = f"{src}:{os.path.getmtime(src)}"
+    return f"{THUMB_DIR}{os.sep}{hashlib.md5(key.encode()).hexdigest()}.jpg"
+
+def _thumbnail(src: str):
+    """
+    Return an optimized 1024px JPEG copy of src under THUMB_DIR, converting
+    it on first display. Transparent pixels are flattened onto white. Falls
+    back to src if the image cannot be converted; that is logged once and
+    src is not converted again.
+    """
+    if src in _failed_thumbnails:
+        return src
+    tmp = None
+    try:
+        dst = _thumbnail_path(src)
+        if os.path.exists(dst):
+            return dst
+        with _open_fast(src) as im:
+            if im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info:
+                rgba = im.convert("RGBA")
+                rgb = Image.new("RGB", rgba.size, (255, 255, 255))
+                rgb.paste(rgba, mask=rgba.getchannel("A"))
+            else:
+                rgb = im.convert("RGB")
+        rgb.thumbnail((1024, 1024), Image.Resampling.BILINEAR)
+        # write to a temp file first so concurrent sessions never see a partial JPEG
+        os.makedirs(THUMB_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=THUMB_DIR, suffix=".jpg")
+        os.close(fd)
+        rgb.save(tmp, "JPEG", quality=82, optimize=True, progressive=True)
+        os.replace(tmp, dst)
+        return dst
+    except Exception:
+        logger.warning("Could not create a thumbnail for %s, serving it as-is", src, exc_info=True)
+        _failed_thumbnails.add(src)
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        return src
 
-@st.cache_data
+@st.cache_resource
 def load_questions(csv_path: str, data_dir: str = "data"):
-    # 1) Read everything
-    df = pd.read_csv(csv_path, encoding="utf-8").fillna("")
+    """
+    Load the quiz questions whose image exists under data_dir/**/test/.
+    The returned list is shared by every session without copying, so
+    callers must treat it and its records as read-only.
+    """
+    # 1) Read only the columns the quiz uses, as Arrow-backed strings, with the
+    #    multi-threaded pyarrow parser
+    df = pd.read_csv(
+        csv_path, engine="pyarrow", usecols=CSV_COLUMNS, dtype="string[pyarrow]", encoding="utf-8"
+    ).fillna("")
+
+    # 2) Build every candidate path at once: data_dir/raw_path with normalized separators
+    rel = (
+        df["image_path"]
+        .str.replace("\\", "/", regex=False)
+        .str.lstrip("/")
+        .str.replace("/", os.sep, regex=False)
+    )
+    wrapped = os.sep + rel + os.sep
+    # skip any image escaping data_dir or not under the "test" subdirectory
+    keep = ~wrapped.str.contains(os.sep + ".." + os.sep, regex=False)
+    keep &= wrapped.str.contains(os.sep + "test" + os.sep, regex=False)
+    df = df[keep]
+    img = data_dir + os.sep + rel[keep]
+
+    # 3) Only keep rows whose image exists exactly at data_dir/raw_path
+    found = img.map(os.path.isfile).astype(bool)
+    if not found.all():
+        logger.warning("Skipped %d questions whose image is missing under %s", (~found).sum(), data_dir)
+    df = df[found].assign(_img=img[found])
+
+    # Rename specific categories for display
+    mapping = {"overconcept": "appropriateness", "inconsistency": "coherency"}
+    renamed = ["l2-category", "attribute"]
+    df[renamed] = df[renamed].replace(mapping)
+    df = df.assign(_prompt_md=(
+        "**" + df["description_moderate"] + "**\n\n**" + df["preference"] + "**"
+    ))
     records = df.to_dict(orient="records")
 
-    # 2) Resolve each path and only keep rows whose image actually exists
-    valid = []
+    # Prepare option mapping (letter->text) or Yes/No once instead of on every rerun
     for r in records:
-        img = resolve_path(r["image_path"], data_dir)
-        # skip any image not located inside data_dir
-        abs_data = os.path.abspath(data_dir)
-        abs_img = os.path.abspath(img)
-        if not abs_img.startswith(abs_data + os.sep):
-            continue
-        # skip any image not under the "test" subdirectory
-        if os.sep + "test" + os.sep not in abs_img:
+        r["_opts"] = {k: r[k] for k in ("A","B","C","D") if r.get(k)} or {"Yes": "Yes", "No": "No"}
+        r["_ans_is_letter"] = r["answer"] in r["_opts"]
+    return records
+
+# image paths currently being converted by a prefetch thread
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+def _prefetch_images(paths):
+    """
+    Convert the thumbnails for paths on a daemon thread so the next
+    questions' images are ready before the user gets to them. No thread is
+    started when they are all converted already or failed to convert.
+    """
+    pending = []
+    for p in paths:
+        if p in _failed_thumbnails:
             continue
-        if os.path.exists(img):
-            r["_img"] = img
-            valid.append(r)
+        try:
+            if not os.path.exists(_thumbnail_path(p)):
+                pending.append(p)
+        except OSError:
+            pass  # reported when the question is actually shown
+    paths = pending
+    with _prefetch_lock:
+        paths = [p for p in paths if p not in _prefetching]
+        _prefetching.update(paths)
+    if not paths:
+        return
 
-    # Rename specific categories for display
-    mapping = {"overconcept": "appropriateness", "inconsistency": "coherency"}
-    for r in valid:
-        if r.get("l2-category") in mapping:
-            r["l2-category"] = mapping[r["l2-category"]]
-        if r.get("attribute") in mapping:
-            r["attribute"] = mapping[r["attribute"]]
-    return valid
+    def work():
+        try:
+            for p in paths:
+                _thumbnail(p)
+        finally:
+            with _prefetch_lock:
+                _prefetching.difference_update(paths)
+
+    threading.Thread(target=work, daemon=True).start()
+
+def _score_table(rows: dict, counts, name: str):
+    """Render a ({label: row}, [correct, total] counts) tally as a table indexed by name."""
+    return pd.DataFrame(counts, index=pd.Index(list(rows), name=name), columns=["correct", "total"])
 
 def main():
     st.set_page_config(page_title="Beat the VLMs: MMPB Quiz", layout="centered")
     st.title("Beat the VLMs: MMPB Quiz")
 
-    # Load all valid questions from data directory
-    qs = load_questions("dataset5.csv", data_dir="data")[:]
-    st.caption(f"🔍 Loaded {len(qs)} questions")
+    # Load all valid questions from data directory (shared and read-only, no copy needed)
+    qs = load_questions("dataset5.csv", data_dir="data")
+    qs_len = len(qs)
+    st.caption(f"🔍 Loaded {qs_len} questions")
 
     # Initialize state
     if "idx" not in st.session_state:
         st.session_state.idx = 0
         st.session_state.score = 0
-        st.session_state.responses = []  # to store per-question results
+        # fixed-size [correct, total] counts per sorted category/attribute/l2 label
+        st.session_state.tallies = {}
+        for col, key in SCORE_COLUMNS.items():
+            rows = {label: i for i, label in enumerate(sorted({q.get(key, "") for q in qs}))}
+            st.session_state.tallies[col] = (rows, np.zeros((len(rows), 2), dtype=np.int32))
 
     idx = st.session_state.idx
 
     # ────────────────────────────────────────────────────────
     # Quiz in progress
     # ────────────────────────────────────────────────────────
-    if idx < len(qs):
+    if idx < qs_len:
         q = qs[idx]
 
         col_q, col_score = st.columns([4, 1])
@@ -73,27 +198,22 @@ def main():
                 f"""
                 <div style="text-align:center; line-height:1.2;">
                   <div style="font-size:14px; font-weight:600; color:#666;">Score</div>
-                  <div style="font-size:18px; font-weight:700;">{st.session_state.score} / {len(qs)}</div>
+                  <div style="font-size:18px; font-weight:700;">{st.session_state.score} / {qs_len}</div>
                 </div>
                 """,
                 unsafe_allow_html=True
             )
 
         with col_q:
-            st.markdown(f"**{q['description_moderate']}**\n\n**{q['preference']}**")
+            st.markdown(q["_prompt_md"])
             try:
-                img = Image.open(q["_img"])
-                st.image(img, use_container_width=True)
+                st.image(_thumbnail(q["_img"]), use_container_width=True)
             except Exception as e:
                 st.error(f"Couldn’t load image:\n{q['_img']}\n{e}")
             st.markdown(f"**Q{idx+1}. {q['question']}**")
+            _prefetch_images([qs[j]["_img"] for j in range(idx + 1, min(idx + 4, qs_len))])
 
-            # Prepare option mapping (letter->text) or Yes/No
-            opt_keys = [k for k in ("A","B","C","D") if q.get(k)]
-            if opt_keys:
-                opts_dict = {k: q[k] for k in opt_keys}
-            else:
-                opts_dict = {"Yes": "Yes", "No": "No"}
+            opts_dict = q["_opts"]
 
             with st.form(key=f"quiz_form_{idx}"):
                 choice_key = st.radio("Select an option:", list(opts_dict.keys()), format_func=lambda x: opts_dict[x])
@@ -102,19 +222,17 @@ def main():
                 if submitted:
                     # Determine correctness: if answer is a letter key, compare keys; else compare text
                     ans = q["answer"]
-                    selected_letter = choice_key
-                    selected_text = opts_dict[choice_key]
-                    if ans in opts_dict:
-                        correct = (selected_letter == ans)
+                    if q["_ans_is_letter"]:
+                        correct = (choice_key == ans)
                     else:
-                        correct = (selected_text == ans)
-
-                    st.session_state.responses.append({
-                        "category":  q.get("category",""),
-                        "attribute": q.get("attribute",""),
-                        "l2":        q.get("l2-category",""),
-                        "correct":   correct
-                    })
+                        correct = (opts_dict[choice_key] == ans)
+
+                    for col, key in SCORE_COLUMNS.items():
+                        rows, counts = st.session_state.tallies[col]
+                        # labels unknown to this session (question list reloaded) are not tallied
+                        row = rows.get(q.get(key, ""))
+                        if row is not None:
+                            counts[row] += (int(correct), 1)
                     if correct:
                         st.session_state.score += 1
                     st.session_state.idx += 1
@@ -124,29 +242,25 @@ def main():
     # ────────────────────────────────────────────────────────
     else:
         st.markdown("## 🎉 Quiz Complete!")
-        st.markdown(f"**Your total score: {st.session_state.score} / {len(qs)}**")
+        st.markdown(f"**Your total score: {st.session_state.score} / {qs_len}**")
 
-        # Convert to DataFrame
-        df = pd.DataFrame(st.session_state.responses)
+        tallies = st.session_state.tallies
 
         # 1) by category
-        df_cat = df.groupby("category")["correct"].agg(correct="sum", total="count")
         st.markdown("### Score by Category")
-        st.table(df_cat)
+        st.table(_score_table(*tallies["category"], "category"))
 
         # 2) by attribute
-        df_attr = df.groupby("attribute")["correct"].agg(correct="sum", total="count")
         st.markdown("### Score by Attribute")
-        st.table(df_attr)
+        st.table(_score_table(*tallies["attribute"], "attribute"))
 
         # 3) by l2-category
-        df_l2 = df.groupby("l2")["correct"].agg(correct="sum", total="count")
         st.markdown("### Score by L2 Category")
-        st.table(df_l2)
+        st.table(_score_table(*tallies["l2"], "l2"))
 
         # Restart button
         if st.button("Restart Quiz"):
-            for k in ("idx","score","responses"):
+            for k in ("idx","score","tallies"):
                 del st.session_state[k]
             st.experimental_rerun()
 